@@ -1,13 +1,25 @@
 TOR_PATH = "/usr/local/bin/tor"
 TOR_PORT = 9050
+TOR_CONTROL_PORT = 9051
+TOR_NEWNYM_ATTEMPTS = 3
+TOR_NEWNYM_WAIT_SECS = 10
+TOR_BOOTSTRAP_TIMEOUT_SECS = 120
 GECKO_DRIVER_PATH = './geckodriver'
 
+REQUEST_TIMEOUT_SECS = 10
+RENTOMETER_PAGE_TIMEOUT_SECS = 30
+
 GOOGLE_CREDENTIALS_FILE = 'real-estate-investing-335904-05fe8a22753f.json'
 REAL_ESTATE_FOLDER_ID = '1Qiv2MVdYjE7KaYUVnWVvnOMAFp4rNPbX'
 
 CACHEDIR = "cache"
 ESTIMATE_FILE = "rent_estimates.pickle"
+SCENARIOS_FILE = "scenarios.csv.gz"
+CACHE_FILE_BUFFERING = 1 << 16
+RENTOMETER_CACHE_FILE = "rentometer"
+RENTOMETER_CACHE_TTL_SECS = 30 * 24 * 60 * 60
 
 LOGSDIR = "logs"
 LOGFILE = "logs.log"
-LOGFMT = "%(asctime)s:%(levelname)s:%(funcName)s:%(message)s"
\ No newline at end of file
+LOGFMT = "%(asctime)s:%(levelname)s:%(funcName)s:%(message)s"
+LOG_BUFFER_CAPACITY = 100  # records buffered before the console log is flushed
\ No newline at end of file
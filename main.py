@@ -1,21 +1,20 @@
-import json, logging, requests, subprocess, traceback, os, enum, time, pickle, inspect, re
+import json, logging, requests, subprocess, traceback, os, enum, time, pickle, inspect, re, itertools, csv, gzip, threading, shelve, socket, selectors
 from selenium import webdriver
-from selenium.common.exceptions import NoSuchElementException
 from selenium.webdriver.firefox.options import Options
 from selenium.webdriver.firefox.service import Service
-from selenium.webdriver.support.ui import Select
-from selenium.webdriver.remote.webelement import WebElement
+from selenium.webdriver.support import expected_conditions
+from selenium.webdriver.support.ui import Select, WebDriverWait
 from selenium.webdriver.common.desired_capabilities import DesiredCapabilities
 from googleapiclient.discovery import build
 from dataclasses import dataclass
-from locale import atof, setlocale, LC_NUMERIC
-from typing import IO, Tuple, Union, Optional
-from gspread import service_account, Spreadsheet, Worksheet, WorksheetNotFound
-from pprint import pprint
-from constants import TOR_PATH, TOR_PORT, GECKO_DRIVER_PATH, GOOGLE_CREDENTIALS_FILE, REAL_ESTATE_FOLDER_ID, CACHEDIR, ESTIMATE_FILE
+from typing import IO, Union, Optional
+from gspread import service_account, Spreadsheet
+from constants import TOR_PATH, TOR_PORT, TOR_CONTROL_PORT, TOR_NEWNYM_ATTEMPTS, TOR_NEWNYM_WAIT_SECS, TOR_BOOTSTRAP_TIMEOUT_SECS, GECKO_DRIVER_PATH, GOOGLE_CREDENTIALS_FILE, REAL_ESTATE_FOLDER_ID, CACHEDIR, ESTIMATE_FILE, SCENARIOS_FILE, CACHE_FILE_BUFFERING, REQUEST_TIMEOUT_SECS, RENTOMETER_PAGE_TIMEOUT_SECS, RENTOMETER_CACHE_FILE, RENTOMETER_CACHE_TTL_SECS
 from types_ import Percentage, DollarAmount, SpreadsheetID
-from utils import calc_monthly_mortgage_payment, calc_down_payment, gspread_retry, get_logger
+from utils import calc_monthly_mortgage_payments, gspread_retry, get_logger
 from functools import cache, cached_property
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 
 
 @dataclass
@@ -24,6 +23,15 @@ class Unit:
   baths: float
 
 
+def fields_to_values(fields: list[dict]) -> dict[str, list[str]]:
+  '''
+  Indexes a listing detail's fields, e.g. [{ "key": "Unit Bedrooms", "values": ["2"] }, ...], by their
+  key so that each one can be looked up without rescanning the list. If a key is repeated, the first
+  field with that key wins.
+  '''
+  return {field.get("key"): field.get("values") for field in reversed(fields)}
+
+
 class Listing:
   '''
   Listing is a single listing. You can optionally pass a list of units (i.e. if units can't be
@@ -39,11 +47,15 @@ class Listing:
     # in the raw_listing to throw an error immediately.
     inspect.getmembers(self)
 
-  @property
+  @cached_property
   def price(self) -> DollarAmount:
     return DollarAmount(self.raw_listing['price']['listed'])
 
-  @property
+  @cached_property
+  def zip_code(self) -> str:
+    return self.raw_listing['location']['zipCode']
+
+  @cached_property
   def pretty_address(self) -> str:
     '''
     returns an address in the form
@@ -56,38 +68,30 @@ class Listing:
     zip_code = location['zipCode']
     return street_addr + ', ' + city + ', ' + state + ' ' + zip_code
 
-  class IncongruentFormat(Warning):
-    '''
-    Warning to be thrown by the self._units_from* functions when they encounter something unexpected.
-    This is a warning because such an incident doesn't mean an error occurred, it just means that the
-    self._units_from* function failed and another one might still work.
-    '''
-    pass
-
-  def _units_from_Unit_Information(self) -> list[Unit]:
+  def _units_from_Unit_Information(self) -> Optional[list[Unit]]:
     '''
     Extracts unit info from a detail in self.raw_listing['detailedInfo']['listingDetails'] that looks like:
     {'name': 'Unit Information', 'subCategories': [{'name': 'Unit 1', 'fields': [{'key': 'Unit 1 Baths', 'values': ['1']}, {'key': 'Unit 1 Bedrooms', 'values': ['4']}, {'key': 'Unit 1 Lease Term', 'values': ['Month to Month']}, {'key': 'Unit 1 Level Number', 'values': ['1']}, {'key': 'Unit 1 Rental Amt Freq', 'values': ['Monthly']}, {'key': 'Unit 1 Rental Amount', 'values': ['$1,399.00']}, {'key': 'Unit 1 Tenant Pays', 'values': ['Electric', 'Heat', 'Hot Water']}]}, {'name': 'Unit 2', 'fields': [{'key': 'Unit 2 Lease Term', 'values': ['Annual']}, {'key': 'Unit 2 Baths', 'values': ['1']}, {'key': 'Unit 2 Level Number', 'values': ['2']}, {'key': 'Unit 2 Rental Amt Freq', 'values': ['Monthly']}, {'key': 'Unit 2 Bedrooms', 'values': ['3']}, {'key': 'Unit 2 Rental Amount', 'values': ['$1,600.00']}, {'key': 'Unit 2 Tenant Pays', 'values': ['Electric', 'Heat', 'Hot Water']}]}]}
 
     If a detail with name 'Unit Information' can't be found or bed or bath information can't be extracted from any unit
-    in precisely this format, it throws an IncongruentFromat warning.
+    in precisely this format, it returns None so that the caller can try another format.
     '''
     try:
       details = self.raw_listing['detailedInfo']['listingDetails']
     except KeyError as e:
       self.logger.debug(
           "Failed to find details from self.raw_listing['detailedInfo']['listingDetails']")
-      raise self.IncongruentFormat()
+      return None
 
     detail = next((d for d in details if d.get('name') == "Unit Information"), None)
     if detail is None:
       self.logger.debug(f"Failed to find a detail where detail['name'] == \"Unit Information\"")
-      raise self.IncongruentFormat()
+      return None
 
     sub_categories = detail.get('subCategories')
     if sub_categories is None:
       self.logger.debug(f"Failed because detail.get('subCategories') == None for detail = {detail}")
-      raise self.IncongruentFormat()
+      return None
 
     units: list[Unit] = []
     for sc in sub_categories:
@@ -112,29 +116,27 @@ class Listing:
       name = sc.get('name')
       if name is None:
         self.logger.debug(f"Failed because sc.get('name') == None for sc = {sc}")
-        raise self.IncongruentFormat()
+        return None
       match = re.match("^Unit \d+", name)  # Look for "Unit 1", "Unit 2", etc.
       if match is None:
         self.logger.debug(
             f"Failed because match = re.match(\"^Unit \\d+\", name) == None for name = {name}")
-        raise self.IncongruentFormat()
+        return None
       unit_n_string = match.string  # This string is "Unit 1", "Unit 2", etc.
       fields = sc.get('fields')
       if not fields:
         self.logger.debug(f"sc.get('fields') == None for sub_category (sc) = {sc}")
-        raise self.IncongruentFormat()
+        return None
       # field = { "key": "Unit 1 Bedrooms", "values": ["4"] } should make beds_vals = ["4"]
-      beds_vals = next((field.get("values")
-                        for field in fields if field.get("key") == unit_n_string + " Bedrooms"),
-                       None)
-      baths_vals = next((field.get("values")
-                         for field in fields if field.get("key") == unit_n_string + " Baths"), None)
+      values_by_key = fields_to_values(fields)
+      beds_vals = values_by_key.get(unit_n_string + " Bedrooms")
+      baths_vals = values_by_key.get(unit_n_string + " Baths")
       if beds_vals is None or baths_vals is None or len(beds_vals) != 1 or len(baths_vals) != 1:
-        # If anything unexpected happened, we alert the caller that we didn't find our detail format.
+        # If anything unexpected happened, we tell the caller that we didn't find our detail format.
         self.logger.debug(
             f"(beds_vals is None or baths_vals is None or len(beds_vals) != 1 or len(baths_vals) != 1) == True for beds_vals = {beds_vals}, baths_vals = {baths_vals}"
         )
-        raise self.IncongruentFormat()
+        return None
 
       beds = float(beds_vals[0])
       baths = float(baths_vals[0])
@@ -142,32 +144,32 @@ class Listing:
 
     return units
 
-  def _units_from_Multi_Family(self) -> list[Unit]:
+  def _units_from_Multi_Family(self) -> Optional[list[Unit]]:
     '''
     Extracts unit info from a detail in self.raw_listing['detailedInfo']['listingDetails'] that looks like:
     {'name': 'Multi Family', 'subCategories': [{'name': 'Multi-Family Information', 'fields': [{'key': 'Unit Count', 'values': ['2']}, {'key': 'NUM OF UNITS', 'values': ['2']}]}, {'name': 'Income & Expenses Information', 'fields': [{'key': 'Gross Annual Income', 'values': ['$0']}, {'key': 'N.O.I. $', 'values': ['$.00']}, {'key': 'Annual Expenses', 'values': ['$0']}]}, {'name': 'Unit 1', 'fields': [{'key': 'Unit Rent Amount', 'values': ['$1,300.00']}, {'key': 'Unit Full Baths', 'values': ['1']}, {'key': 'Unit Bedrooms', 'values': ['2']}, {'key': 'Unit Available Date', 'values': ['08-31-2021 08:00:00 PM']}, {'key': 'Unit Deposit Amount', 'values': ['$.00']}, {'key': 'Unit Features', 'values': ['Deck', 'Dishwasher', 'Hardwood Floors', 'Range/Oven']}, {'key': 'Unit Garbage Included', 'values': ['Yes']}, {'key': 'Unit Gas Included', 'values': ['No']}, {'key': 'Unit Half Baths', 'values': ['0']}, {'key': 'Unit Maintenance Included', 'values': ['No']}, {'key': 'Unit Occupant', 'values': ['Avail In 1-3 Mon']}, {'key': 'Unit Water Included', 'values': ['No']}, {'key': 'Unit Electric Included', 'values': ['No']}]}, {'name': 'Unit 2', 'fields': [{'key': 'Unit Rent Amount', 'values': ['$1,300.00']}, {'key': 'Unit Full Baths', 'values': ['1']}, {'key': 'Unit Bedrooms', 'values': ['2']}, {'key': 'Unit Available Date', 'values': ['08-31-2021 08:00:00 PM']}, {'key': 'Unit Deposit Amount', 'values': ['$1,300.00']}, {'key': 'Unit Features', 'values': ['Deck', 'Dishwasher', 'Hardwood Floors', 'Range/Oven']}, {'key': 'Unit Garbage Included', 'values': ['Yes']}, {'key': 'Unit Gas Included', 'values': ['No']}, {'key': 'Unit Half Baths', 'values': ['0']}, {'key': 'Unit Maintenance Included', 'values': ['No']}, {'key': 'Unit Occupant', 'values': ['Avail In 1-3 Mon']}, {'key': 'Unit Water Included', 'values': ['No']}, {'key': 'Unit Electric Included', 'values': ['No']}]}]}
 
     If a detail with name 'Unit Information' can't be found or bed or bath information can't be extracted from any unit
-    in precisely this format, it throws an IncongruentFromat warning.
+    in precisely this format, it returns None so that the caller can try another format.
     '''
     try:
       details = self.raw_listing['detailedInfo']['listingDetails']
     except KeyError as e:
       self.logger.debug(
           "Failed to find details from self.raw_listing['detailedInfo']['listingDetails']")
-      raise self.IncongruentFormat()
+      return None
 
     detail = next((d for d in details if d.get('name') == "Multi Family"), None)
     if detail is None:
       self.logger.debug(
           f"Failed to find a detail where detail['name'] == \"Multi Family\" in details = {details}"
       )
-      raise self.IncongruentFormat()
+      return None
 
     sub_categories = detail.get('subCategories')
     if sub_categories is None:
       self.logger.debug(f"Failed because detail.get('subCategories') == None for detail = {detail}")
-      raise self.IncongruentFormat()
+      return None
 
     units: list[Unit] = []
     for sc in sub_categories:
@@ -201,7 +203,7 @@ class Listing:
       name = sc.get('name')
       if name is None:
         self.logger.debug(f"Failed because sc.get('name') == None for sc = {sc}")
-        raise self.IncongruentFormat()
+        return None
       match = re.match("^Unit \d+", name)  # Look for "Unit 1", "Unit 2", etc.
       if match is None:
         # It's valid for some subcategories not to match, if we encounter those just continue.
@@ -211,21 +213,19 @@ class Listing:
       fields = sc.get('fields')
       if not fields:
         self.logger.debug(f"sc.get('fields') == None for sub_category (sc) = {sc}")
-        raise self.IncongruentFormat()
-      # field = { "key": "Unit 1 Bedrooms", "values": ["4"] } should make beds_vals = ["4"]
-      beds_vals = next(
-          (field.get("values") for field in fields if field.get("key") == "Unit Bedrooms"), None)
-      baths_vals = next(
-          (field.get("values") for field in fields if field.get("key") == "Unit Full Baths"), None)
-      half_baths_vals = next(
-          (field.get("values") for field in fields if field.get("key") == "Unit Half Baths"), None)
+        return None
+      # field = { "key": "Unit Bedrooms", "values": ["2"] } should make beds_vals = ["2"]
+      values_by_key = fields_to_values(fields)
+      beds_vals = values_by_key.get("Unit Bedrooms")
+      baths_vals = values_by_key.get("Unit Full Baths")
+      half_baths_vals = values_by_key.get("Unit Half Baths")
       if beds_vals is None or baths_vals is None or half_baths_vals is None or len(
           beds_vals) != 1 or len(baths_vals) != 1 or len(half_baths_vals) != 1:
-        # If anything unexpected happened, we alert the caller that we didn't find our detail format.
+        # If anything unexpected happened, we tell the caller that we didn't find our detail format.
         self.logger.debug(
             f"(beds_vals is None or baths_vals is None or half_baths_vals is None or len(beds_vals) != 1 or len(baths_vals) != 1  or len(half_baths_vals) != 1 for beds_vals = {beds_vals}, baths_vals = {baths_vals}, half_baths_vals = {half_baths_vals}"
         )
-        raise self.IncongruentFormat()
+        return None
 
       beds = float(beds_vals[0])
       baths = float(baths_vals[0]) + float(half_baths_vals[0])
@@ -243,20 +243,18 @@ class Listing:
       self.logger.debug(f'Skipping unit extraction and using the passed in units: {self._units}')
       return self._units
 
-    units: Optional[list[Unit]] = None
-    for unit_extractor in [self._units_from_Unit_Information, self._units_from_Multi_Family]:
-      try:
-        units = unit_extractor()
-        break
-      except self.IncongruentFormat:
-        continue
-    if units is None or len(units) == 0:
-      self.logger.debug(f"Unit extraction failed for self.raw_listing = {self.raw_listing}")
-      raise Exception("Failed to find a known format for extracting unit info")
+    for unit_extractor in (self._units_from_Unit_Information, self._units_from_Multi_Family):
+      units = unit_extractor()
+      if units:
+        self.logger.debug(f"Successfully extracted units: {units}")
+        return units
 
-    self.logger.debug(f"Successfully extracted units: {units}")
+    self.logger.debug(f"Unit extraction failed for self.raw_listing = {self.raw_listing}")
+    raise Exception("Failed to find a known format for extracting unit info")
 
-    return units
+
+INITIAL_DATA_MARKER = "window.__PARTIAL_INITIAL_DATA__ = "
+JSON_DECODER = json.JSONDecoder()
 
 
 def from_raw(raw: str, units: list[Unit] = None) -> Listing:
@@ -265,9 +263,13 @@ def from_raw(raw: str, units: list[Unit] = None) -> Listing:
   listing and extracts the raw listing information from the javascript.
   '''
   logging.info("Extracting raw listing")
-  return Listing(
-      json.loads(raw.split("window.__PARTIAL_INITIAL_DATA__ = ")[1].split("</script>")[0].strip())
-      ['props']['listingRelation']['listing'], units)
+  # Decode the JSON in place, starting right after the marker, rather than splitting copies of the
+  # whole page. raw_decode stops at the end of the JSON object, so we don't need to find </script>.
+  start = raw.index(INITIAL_DATA_MARKER) + len(INITIAL_DATA_MARKER)
+  # raw_decode doesn't skip leading whitespace (the old split did .strip()), so skip past any here.
+  start = json.decoder.WHITESPACE.match(raw, start).end()
+  initial_data, _ = JSON_DECODER.raw_decode(raw, start)
+  return Listing(initial_data['props']['listingRelation']['listing'], units)
 
 
 class EstimateType(enum.Enum):
@@ -280,6 +282,34 @@ class EstimateType(enum.Enum):
   PERCENTILE_75 = "75th percentile"
 
 
+# Maps the heading of each of Rentometer's "box-stats" elements to the type of estimate it holds.
+STAT_ESTIMATE_TYPES: dict[str, EstimateType] = {
+    'AVERAGE': EstimateType.AVERAGE,
+    'MEDIAN': EstimateType.MEDIAN,
+    '25TH PERCENTILE': EstimateType.PERCENTILE_25,
+    '75TH PERCENTILE': EstimateType.PERCENTILE_75,
+}
+
+# Matches a stat's heading and the amount that follows it, e.g. "AVERAGE\n$1,234". Rentometer always
+# formats amounts US style, e.g. "$1,234" or "$1,234.56".
+STAT_RE = re.compile(r"(%s).*?\$([\d,]+(?:\.\d+)?)" % "|".join(map(re.escape, STAT_ESTIMATE_TYPES)),
+                     re.DOTALL)
+
+# Reads the "not enough results" warning (if there is one) and the text of each of the "box-stats"
+# elements off of Rentometer's results page.
+READ_RESULTS_PAGE_JS = '''
+const warning = document.evaluate("/html/body/div[3]/div", document, null,
+                                  XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+return {
+  warning: warning === null ? null : warning.innerText,
+  stats: Array.from(document.getElementsByClassName("box-stats"), stat => stat.innerText),
+};
+'''
+
+# shelve doesn't support concurrent access, and units are estimated from several threads at once.
+RENTOMETER_CACHE_LOCK = threading.Lock()
+
+
 @dataclass
 class RentEstimatedUnit:
   unit: Unit
@@ -292,97 +322,282 @@ class RentEstimate:
   type: EstimateType
 
 
-class RentEstimator(object):
+@dataclass
+class TorBrowser:
+  slot: int
+  tor: subprocess.Popen[bytes]
+  browser: webdriver.Firefox
+
+
+class TorBrowserPool(object):
   '''
-  RentEstimator uses selenium (ff proxied through TOR) to query https://www.rentometer.com/ for a rent estimate.
+  TorBrowserPool hands out Rentometer browsers (ff proxied through TOR) and keeps them alive between
+  uses, so that TOR and Firefox are only relaunched when Rentometer starts throttling a browser rather
+  than for every listing. Browsers are started lazily, up to size at once. Each one gets its own TOR
+  instance (and therefore its own SocksPort and DataDirectory) so that they can run side by side.
   geckodriver is the path to the Gecko driver binary (https://github.com/mozilla/geckodriver/releases).
   '''
-  def __init__(
-      self,
-      logger: logging.Logger,
-      geckodriver: str = GECKO_DRIVER_PATH,
-  ):
+  def __init__(self,
+               logger: logging.Logger,
+               size: int = os.cpu_count() or 1,
+               geckodriver: str = GECKO_DRIVER_PATH):
     self.logger = logger
-    self.browser: webdriver.Firefox
-    self.tor: subprocess.Popen[bytes]
+    self.size = size
     self.geckodriver = geckodriver
-    self.estimates: list[RentEstimate]
+    self._ready: list[TorBrowser] = []
+    self._live: dict[int, TorBrowser] = {}
+    self._free_slots = list(range(size))
+    self._lock = threading.Lock()
+    # Signalled whenever a browser is released or a slot is freed, waking a blocked acquire().
+    self._available = threading.Condition(self._lock)
+
+  def acquire(self) -> TorBrowser:
+    '''
+    Returns an idle browser, starting a new one if none are idle and the pool isn't full yet.
+    Otherwise blocks until another user releases theirs, or discards theirs and frees up its slot.
+    '''
+    with self._available:
+      while not self._ready and not self._free_slots:
+        self._available.wait()
+      if self._ready:
+        return self._ready.pop()
+      slot = self._free_slots.pop(0)
+    try:
+      return self._spawn(slot)
+    except BaseException:
+      self._free_slot(slot)
+      raise
 
-  # TODO: could become a RentometerBrowser class
-  def _get_unthrottled_tor_browser(self) -> Tuple[subprocess.Popen[bytes], webdriver.Firefox]:
+  def release(self, member: TorBrowser):
+    '''
+    Puts a browser that is still usable back in the pool, first taking it back to Rentometer's home
+    page so the next user doesn't start from whatever form state this one left behind.
+    '''
+    try:
+      member.browser.get("https://www.rentometer.com/")
+    except Exception:
+      self.logger.warning(f"Failed to reset browser {member.slot}: {traceback.format_exc()}")
+      self.discard(member)
+      return
+    with self._available:
+      self._ready.append(member)
+      self._available.notify()
+
+  def discard(self, member: TorBrowser):
+    '''
+    Kills a browser that is in an unknown state, freeing its slot for a fresh one.
+    '''
+    self._kill(member)
+    self._free_slot(member.slot)
+
+  def _free_slot(self, slot: int):
+    with self._available:
+      self._free_slots.append(slot)
+      self._available.notify()
+
+  def recycle(self, member: TorBrowser) -> TorBrowser:
+    '''
+    Gets a throttled browser a new TOR exit node, or if that doesn't help, kills it and returns a fresh
+    one in its place.
+    '''
+    if self._renew_until_unthrottled(member):
+      return member
+    self._kill(member)
+    try:
+      return self._spawn(member.slot)
+    except BaseException:
+      self._free_slot(member.slot)
+      raise
+
+  def close(self):
+    # Close every browser and kill every TOR, whether or not they're currently in use.
+    with self._lock:
+      members = list(self._live.values())
+    for member in members:
+      self._kill(member)
+
+  def _kill(self, member: TorBrowser):
+    with self._lock:
+      self._live.pop(member.slot, None)
+    self._stop(member.slot, member.tor, member.browser)
+
+  def _stop(self, slot: int, tor: subprocess.Popen[bytes], browser: Optional[webdriver.Firefox]):
+    self.logger.info(f"Closing browser {slot} and killing its TOR")
+    if browser is not None:
+      try:
+        browser.quit()
+      except Exception:
+        # The browser may already be gone, TOR still needs to be killed either way.
+        self.logger.warning(f"Failed to close browser {slot}: {traceback.format_exc()}")
+    tor.kill()
+    tor.wait()
+
+  def _spawn(self, slot: int) -> TorBrowser:
     '''
     Sometimes if the TOR output node is known to Rentometer (or perhaps by some other mechanism),
     Rentometer will say that your free search limit is reached and the "Analyze" button will be inactive.
-    Keep restarting TOR and loading up Rentometer until we get a page where we can actually hit "Analyze".
+    Keep getting new TOR exit nodes (or restarting TOR if that doesn't help) and loading up Rentometer
+    until we get a page where we can actually hit "Analyze".
     '''
+    # Each slot takes a pair of ports, so that they line up with TOR's defaults for slot 0.
+    socks_port = TOR_PORT + 2 * slot
+    control_port = TOR_CONTROL_PORT + 2 * slot
+    data_dir = self._data_dir(slot)
+    os.makedirs(data_dir, mode=0o700, exist_ok=True)
+
     # Set up TOR proxy options.
     options = Options()
-    options.headless = False  #TODO
+    options.headless = True
     options.set_preference('network.proxy.type', 1)
     options.set_preference('network.proxy.socks', '127.0.0.1')
-    options.set_preference('network.proxy.socks_port', TOR_PORT)
+    options.set_preference('network.proxy.socks_port', socks_port)
+
+    # We only ever read text off of Rentometer, so skip loading images, keep to a single content
+    # process and don't write the page cache to disk.
+    options.set_preference('permissions.default.image', 2)
+    options.set_preference('dom.ipc.processCount', 1)
+    options.set_preference('browser.cache.disk.enable', False)
+
+    # A new TOR identity only applies to new connections, so don't let Firefox hold on to an idle
+    # connection (and the old exit node) for longer than we wait after asking for one.
+    options.set_preference('network.http.keep-alive.timeout', TOR_NEWNYM_WAIT_SECS // 2)
 
     # Set Selenium to become active as soon as the page becomes interactive,
     # rather than waiting until it's fully loaded.
     capabilities = DesiredCapabilities().FIREFOX
     capabilities["pageLoadStrategy"] = "eager"
 
-    analyze_button_disabled = True
-    while analyze_button_disabled:
-      self.logger.info("Starting TOR...")
+    while True:
+      self.logger.info(f"Starting TOR on port {socks_port}...")
       # Start TOR and wait for it to boot up.
-      # TODO: add a timeout here.
-      tor = subprocess.Popen(TOR_PATH, stdout=subprocess.PIPE)
-      maybe_stdout = tor.stdout
-      if maybe_stdout is None:
-        raise Exception("stdout was None")
-      stdout: IO[bytes] = maybe_stdout
-      while True:
-        line = stdout.readline()
-        self.logger.debug(f"TOR startup output: {'{!r}'.format(line)}")
-        if b"100% (done): Done" in line:
-          break
-      self.logger.info(f"TOR started successfully")
-
-      # Create a TOR browser
-      self.logger.info(f"Opening browser...")
-      browser = webdriver.Firefox(service=Service(self.geckodriver),
-                                  options=options,
-                                  capabilities=capabilities)
-
-      # Connect to Rentometer and check if the analyze_button is disabled.
-      self.logger.info(f"Connecting to https://www.rentometer.com/")
-      browser.get("https://www.rentometer.com/")
-      self.logger.info(f"https://www.rentometer.com/ connection succeeded")
-      self.logger.info(f"Checking if the \"Analyze\" button is enabled")
-      analyze_button = browser.find_element_by_name("commit")
-      analyze_button_disabled = analyze_button.get_attribute("disabled") == "true"
-
-      # If the analyze button is disabled, kill the browser and TOR and try again.
-      if analyze_button_disabled:
-        self.logger.warning(
-            "Opened Rentometer \"Analyze\" button was disabled. Killing the browser and TOR and trying again."
-        )
-        browser.close()
-        tor.kill()
-      else:
+      tor_args = [TOR_PATH, "--SocksPort", str(socks_port), "--ControlPort", str(control_port)]
+      tor_args += ["--CookieAuthentication", "1", "--DataDirectory", data_dir]
+      tor = subprocess.Popen(tor_args, stdout=subprocess.PIPE)
+      browser: Optional[webdriver.Firefox] = None
+      try:
+        self._wait_for_bootstrap(tor)
+        self.logger.info(f"TOR started successfully")
+
+        # Create a TOR browser
+        self.logger.info(f"Opening browser...")
+        browser = webdriver.Firefox(service=Service(self.geckodriver),
+                                    options=options,
+                                    capabilities=capabilities)
+        member = TorBrowser(slot, tor, browser)
+        unthrottled = self._analyze_enabled(browser) or self._renew_until_unthrottled(member)
+      except BaseException:
+        # The member isn't in self._live yet, so close() wouldn't find it. Don't leave TOR holding on
+        # to this slot's ports and DataDirectory (or the browser running) for the next _spawn.
+        self._stop(slot, tor, browser)
+        raise
+
+      if unthrottled:
         self.logger.info("Got a Rentometer browser with the \"Analyze\" button enabled.")
+        break
 
-    return (tor, browser)
+      # If the analyze button is still disabled, kill the browser and TOR and try again.
+      self.logger.warning(
+          "Opened Rentometer \"Analyze\" button was disabled. Killing the browser and TOR and trying again."
+      )
+      self._kill(member)
 
-  def _nuke_tor_browser(self):
-    # Close the browser and kill TOR.
-    self.logger.info("Closing the browser and killing TOR")
-    try:
-      self.browser.quit()
-    except AttributeError:
-      # self.browser wasn't set
-      pass
-    try:
-      self.tor.kill()
-    except AttributeError:
-      # self.tor wasn't set
-      pass
+    with self._lock:
+      self._live[slot] = member
+    return member
+
+  def _wait_for_bootstrap(self, tor: subprocess.Popen[bytes]):
+    '''
+    Waits for tor to report that it has finished bootstrapping. Raises if it exits first, or hasn't
+    finished within TOR_BOOTSTRAP_TIMEOUT_SECS.
+    '''
+    maybe_stdout = tor.stdout
+    if maybe_stdout is None:
+      raise Exception("stdout was None")
+    stdout: IO[bytes] = maybe_stdout
+    # Read whatever output is available as it arrives (rather than blocking in readline), so that the
+    # deadline can be enforced. The "Done" message might be split across reads, so keep it all.
+    fd = stdout.fileno()
+    deadline = time.monotonic() + TOR_BOOTSTRAP_TIMEOUT_SECS
+    output = b""
+    with selectors.DefaultSelector() as selector:
+      selector.register(fd, selectors.EVENT_READ)
+      while b"100% (done): Done" not in output:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not selector.select(remaining):
+          raise Exception(f"TOR didn't finish starting up within {TOR_BOOTSTRAP_TIMEOUT_SECS}s")
+        chunk = os.read(fd, 4096)
+        if not chunk:
+          raise Exception(f"TOR exited before it finished starting up (code {tor.wait()})")
+        self.logger.debug(f"TOR startup output: {chunk!r}")
+        output += chunk
+
+    # Pooled TOR processes live for the whole run, so keep reading their output; otherwise TOR would
+    # block writing its log once the pipe fills up. The thread ends when TOR exits and closes it.
+    def drain():
+      while chunk := os.read(fd, 4096):
+        self.logger.debug(f"TOR output: {chunk!r}")
+
+    threading.Thread(target=drain, name=f"tor-{tor.pid}-stdout", daemon=True).start()
+
+  def _data_dir(self, slot: int) -> str:
+    return os.path.join(CACHEDIR, "tor", str(slot))
+
+  def _analyze_enabled(self, browser: webdriver.Firefox) -> bool:
+    # Connect to Rentometer and check if the analyze_button is disabled.
+    self.logger.info(f"Connecting to https://www.rentometer.com/")
+    browser.get("https://www.rentometer.com/")
+    self.logger.info(f"https://www.rentometer.com/ connection succeeded")
+    self.logger.info(f"Checking if the \"Analyze\" button is enabled")
+    analyze_button = browser.find_element_by_name("commit")
+    return analyze_button.get_attribute("disabled") != "true"
+
+  def _renew_until_unthrottled(self, member: TorBrowser) -> bool:
+    '''
+    Asks member's TOR for a new identity (new circuits, and so most likely a new exit node) and
+    reloads Rentometer, up to TOR_NEWNYM_ATTEMPTS times, which is much quicker than restarting TOR.
+    Returns whether the "Analyze" button ended up enabled.
+    '''
+    for attempt in range(1, TOR_NEWNYM_ATTEMPTS + 1):
+      self.logger.info(
+          f"Asking TOR {member.slot} for a new identity (attempt {attempt}/{TOR_NEWNYM_ATTEMPTS})")
+      try:
+        self._signal_newnym(member.slot)
+      except Exception:
+        self.logger.warning(f"Failed to get a new TOR identity: {traceback.format_exc()}")
+        return False
+      # Give Firefox time to drop its connection over the old circuit. TOR won't switch identities
+      # more than about once every 10 seconds anyway.
+      time.sleep(TOR_NEWNYM_WAIT_SECS)
+      if self._analyze_enabled(member.browser):
+        return True
+    return False
+
+  def _signal_newnym(self, slot: int):
+    '''
+    Sends SIGNAL NEWNYM to the TOR in slot over its ControlPort, authenticating with the cookie TOR
+    writes to its DataDirectory.
+    '''
+    with open(os.path.join(self._data_dir(slot), "control_auth_cookie"), 'rb') as f:
+      cookie = f.read().hex()
+    control_port = TOR_CONTROL_PORT + 2 * slot
+    with socket.create_connection(("127.0.0.1", control_port),
+                                  timeout=REQUEST_TIMEOUT_SECS) as conn:
+      conn.sendall(f"AUTHENTICATE {cookie}\r\nSIGNAL NEWNYM\r\nQUIT\r\n".encode())
+      # TOR closes the connection after QUIT, so this reads all three replies.
+      replies = conn.makefile('rb').read().splitlines()
+    if replies[:2] != [b"250 OK", b"250 OK"]:
+      raise Exception(f"TOR didn't accept SIGNAL NEWNYM, replies: {replies}")
+
+
+class RentEstimator(object):
+  '''
+  RentEstimator uses selenium (ff proxied through TOR) to query https://www.rentometer.com/ for a rent estimate.
+  Browsers are borrowed from pool for the duration of an estimate.
+  '''
+  def __init__(self, logger: logging.Logger, pool: TorBrowserPool):
+    self.logger = logger
+    self.pool = pool
+    self.estimates: list[RentEstimate]
 
   def estimate(self, listing: Listing) -> list[RentEstimate]:
     self.logger.info(f"Estimating the rents at {listing.pretty_address}")
@@ -391,7 +606,8 @@ class RentEstimator(object):
     estimate_cache_file = os.path.join(estimate_cache_dir, ESTIMATE_FILE)
     self.logger.info(f"Checking for cached estimates at {estimate_cache_file}")
     try:
-      with open(estimate_cache_file, 'rb') as f:
+      with open(estimate_cache_file, 'rb', buffering=CACHE_FILE_BUFFERING) as f:
+        # The pickle protocol is detected automatically when loading.
         self.estimates = pickle.load(f)
         self.logger.info(
             f"Found cached estimates for {listing.pretty_address}, using those for analysis")
@@ -417,24 +633,86 @@ class RentEstimator(object):
       if estimate not in self.estimates:
         self.estimates.append(estimate)
 
+    # Each unit is looked up in its own browser (with its own TOR circuit), so they can all be
+    # looked up at once, up to the size of the pool.
+    unit_workers = max(1, min(self.pool.size, len(listing.units)))
+    with ThreadPoolExecutor(max_workers=unit_workers) as executor:
+      unit_futures = [executor.submit(self._estimate_one, listing, unit) for unit in listing.units]
+
+    try:
+      # Collect in unit order, so the estimates are the same as when units were done one by one.
+      for unit, unit_future in zip(listing.units, unit_futures):
+        for estimate_type, monthly_rent in unit_future.result().items():
+          add_estimate(estimate_type, unit, monthly_rent)
+    except Exception:
+      self.logger.error(
+          f"Unexpected error encountered while creating rent estimate: {traceback.format_exc()}")
+    finally:
+      # Cache estimates if they were made
+      if self.estimates:
+        os.makedirs(estimate_cache_dir, exist_ok=True)
+        with open(estimate_cache_file, 'wb', buffering=CACHE_FILE_BUFFERING) as f:
+          self.logger.info(f"Caching estimates at {estimate_cache_file}")
+          pickle.dump(self.estimates, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    return self.estimates
+
+  def _estimate_one(self, listing: Listing, unit: Unit) -> dict[EstimateType, DollarAmount]:
+    '''
+    Returns the estimated monthly rent for each EstimateType for a single unit. Rentometer's answer
+    for a given zip code, number of beds and "Baths" option is reused for RENTOMETER_CACHE_TTL_SECS,
+    so a unit is only looked up in a browser if a similar one hasn't been recently.
+    '''
+    self.logger.info(f"Estimating rent for unit: {unit}")
+    # Mirrors the "Baths" option chosen in enter_listing_info_and_click_analyze.
+    baths_option = "1" if unit.baths == 1 else "1.5" if unit.baths > 1 else ""
+    cache_key = f"{listing.zip_code}|{int(unit.beds)}|{baths_option}"
+
+    cache_file = os.path.join(CACHEDIR, RENTOMETER_CACHE_FILE)
+    with RENTOMETER_CACHE_LOCK:
+      os.makedirs(CACHEDIR, exist_ok=True)
+      with shelve.open(cache_file) as rentometer_cache:
+        cached = rentometer_cache.get(cache_key)
+    if cached is not None:
+      cached_at, estimate = cached
+      if time.time() - cached_at < RENTOMETER_CACHE_TTL_SECS:
+        self.logger.info(f"Using cached Rentometer estimate for {cache_key}")
+        return estimate
+
+    estimate = self._scrape_one(listing.pretty_address, unit)
+    # Only cache complete answers, so a bad page doesn't get reused for the rest of the TTL.
+    if len(estimate) == len(STAT_ESTIMATE_TYPES) and 0 not in estimate.values():
+      with RENTOMETER_CACHE_LOCK, shelve.open(cache_file) as rentometer_cache:
+        rentometer_cache[cache_key] = (time.time(), estimate)
+    return estimate
+
+  def _scrape_one(self, pretty_address: str, unit: Unit) -> dict[EstimateType, DollarAmount]:
+    '''
+    Looks up a single unit on Rentometer using a browser from the pool, returning the estimated
+    monthly rent for each EstimateType.
+    '''
+    member = self.pool.acquire()
     try:
-      self.tor, self.browser = self._get_unthrottled_tor_browser()
 
       def enter_listing_info_and_click_analyze(pretty_address: str, beds: float, baths: float):
         '''
         baths <= 0 will select "Any" for the number of bathrooms
         '''
+        nonlocal member
         # Find the relevant UI elements
-        analyze_button = self.browser.find_element_by_name("commit")
+        analyze_button = member.browser.find_element_by_name("commit")
         if analyze_button.get_attribute("disabled") == "true":
-          # If rentometer is throttling our Analyze requests, kill the browser and TOR and reboot them until we can analyze again.
-          self._nuke_tor_browser()
-          self.tor, self.browser = self._get_unthrottled_tor_browser()
+          # If rentometer is throttling our Analyze requests, swap in a fresh browser and TOR.
+          member = self.pool.recycle(member)
+          analyze_button = member.browser.find_element_by_name("commit")
 
-        address_box = self.browser.find_element_by_id("address_unified_search_address")
-        beds_selector = Select(self.browser.find_element_by_id("address_unified_search_bed_style"))
-        baths_selector = Select(self.browser.find_element_by_id("address_unified_search_baths"))
+        address_box = member.browser.find_element_by_id("address_unified_search_address")
+        beds_selector = Select(
+            member.browser.find_element_by_id("address_unified_search_bed_style"))
+        baths_selector = Select(member.browser.find_element_by_id("address_unified_search_baths"))
 
+        # The results page's form keeps the last address, which send_keys would append to.
+        address_box.clear()
         address_box.send_keys(pretty_address)
         self.logger.info(f"Entered {pretty_address} into the address box")
 
@@ -457,96 +735,75 @@ class RentEstimator(object):
         # Click analyze button to get analysis (typically opens a new page).
         self.logger.info("Clicking the analyze button")
         analyze_button.click()
+        # Wait for the page we clicked on to go away, so that we don't read it as the results.
+        WebDriverWait(member.browser, RENTOMETER_PAGE_TIMEOUT_SECS,
+                      poll_frequency=0.1).until(expected_conditions.staleness_of(analyze_button))
 
       class NotEnoughResults(Exception):
         pass
 
-      def check_not_enough_results():
+      def read_results_page() -> list[str]:
         '''
         raises NotEnoughResults if we get the "sorry not enough results" warning from rentometer,
-        returns otherwise
+        otherwise returns the text of each of the "box-stats" elements.
         '''
+        not_enough_results = "Sorry, there are not enough results in that location to generate a valid analysis."
+
+        def results_loaded(browser: webdriver.Firefox) -> Optional[dict]:
+          # Every element lookup or .text is a round trip to the WebDriver, so read everything we need
+          # off of the page in a single script.
+          page = browser.execute_script(READ_RESULTS_PAGE_JS)
+          if page['stats'] or not_enough_results in (page['warning'] or ""):
+            return page
+          return None
+
+        # Poll until either the stats or the warning show up, rather than reading the page before it's
+        # finished loading.
+        page = WebDriverWait(member.browser, RENTOMETER_PAGE_TIMEOUT_SECS,
+                             poll_frequency=0.1).until(results_loaded)
+        if not_enough_results in (page['warning'] or ""):
+          self.logger.warning(f"Rentometer says: \"{not_enough_results}\" for {unit}")
+          raise NotEnoughResults
+        # This is the happy path.
+        self.logger.info("Analysis succeeded")
+        return page['stats']
+
+      enter_listing_info_and_click_analyze(pretty_address, unit.beds, unit.baths)
+      # Check that rentometer was able to find enough results.
+      try:
+        stat_texts = read_results_page()
+      except NotEnoughResults:
+        self.logger.info("Retrying with \"Any\" for the number of bathrooms")
+        enter_listing_info_and_click_analyze(pretty_address, unit.beds, -1)
         try:
-          if "Sorry, there are not enough results in that location to generate a valid analysis." in self.browser.find_element_by_xpath(
-              "/html/body/div[3]/div").text:
-            self.logger.warning(
-                f"Rentometer says: \"Sorry, there are not enough results in that location to generate a valid analysis.\" for {unit}"
-            )
-            self.logger.info("Retrying with \"Any\" for the number of bathrooms")
-            # TODO all the above logic should be wrapped in a try logic, if the exception that will be thrown here is caught then
-            # we should retry with "Any" baths.
-            raise NotEnoughResults
-        except NoSuchElementException:
-          # This is the happy path.
-          self.logger.info("Analysis succeeded")
-
-      for unit in listing.units:
-        self.logger.info(f"Estimating rent for unit: {unit}")
-        enter_listing_info_and_click_analyze(listing.pretty_address, unit.beds, unit.baths)
-        # Check that rentometer was able to find enough results.
-        try:
-          check_not_enough_results()
+          stat_texts = read_results_page()
         except NotEnoughResults:
-          self.logger.info("Retrying with \"Any\" for the number of bathrooms")
-          enter_listing_info_and_click_analyze(listing.pretty_address, unit.beds, -1)
-          try:
-            check_not_enough_results()
-          except NotEnoughResults:
-            # This is the happy path.
-            self.logger.error("Analysis failed with \"Any\" as the number of bathrooms")
-            self.logger.debug(
-                "Setting the rent estimates for this unit at 0 and continuing with analysis")
-            for estimate_type in [
-                EstimateType.AVERAGE, EstimateType.MEDIAN, EstimateType.PERCENTILE_25,
-                EstimateType.PERCENTILE_75
-            ]:
-              add_estimate(estimate_type, unit, 0)
-              continue
-
-        # Now we're on the analysis page.
-        stats: list[WebElement] = self.browser.find_elements_by_class_name("box-stats")
-        average: DollarAmount = 0
-        median: DollarAmount = 0
-        twenty_fifth_percentile: DollarAmount = 0
-        seventy_fifth_percentile: DollarAmount = 0
-        setlocale(LC_NUMERIC, '')  # set to default locale
-
-        def extract_dollar_value(stat: WebElement) -> DollarAmount:
-          return DollarAmount(atof(stat.text.split('$')[-1]))
-
-        for stat in stats:
-          if 'AVERAGE' in stat.text:
-            average = extract_dollar_value(stat)
-            add_estimate(EstimateType.AVERAGE, unit, average)
-          elif 'MEDIAN' in stat.text:
-            median = extract_dollar_value(stat)
-            add_estimate(EstimateType.MEDIAN, unit, median)
-          elif '25TH PERCENTILE' in stat.text:
-            twenty_fifth_percentile = extract_dollar_value(stat)
-            add_estimate(EstimateType.PERCENTILE_25, unit, twenty_fifth_percentile)
-          elif '75TH PERCENTILE' in stat.text:
-            seventy_fifth_percentile = extract_dollar_value(stat)
-            add_estimate(EstimateType.PERCENTILE_75, unit, seventy_fifth_percentile)
-          else:
-            self.logger.warning(f"Unexpected stat in stats box: {stat.text}")
-
-        if average == 0 or median == 0 or twenty_fifth_percentile == 0 or seventy_fifth_percentile == 0:
-          self.logger.warning(
-              f"Could not extract at least one stat from stats box: {[s.text for s in stats]}")
+          self.logger.error("Analysis failed with \"Any\" as the number of bathrooms")
+          self.logger.debug(
+              "Setting the rent estimates for this unit at 0 and continuing with analysis")
+          self.pool.release(member)
+          return {estimate_type: 0 for estimate_type in STAT_ESTIMATE_TYPES.values()}
+
+      # Now we're on the analysis page.
+      extracted: dict[EstimateType, DollarAmount] = {}
+
+      for text in stat_texts:
+        match = STAT_RE.search(text)
+        if match is None:
+          self.logger.warning(f"Unexpected stat in stats box: {text}")
+          continue
+        heading, amount = match.groups()
+        extracted[STAT_ESTIMATE_TYPES[heading]] = DollarAmount(amount.replace(',', ''))
+
+      if len(extracted) != len(STAT_ESTIMATE_TYPES) or 0 in extracted.values():
+        self.logger.warning(f"Could not extract at least one stat from stats box: {stat_texts}")
     except Exception:
-      self.logger.error(
-          f"Unexpected error encountered while creating rent estimate: {traceback.format_exc()}")
-    finally:
-      # Cache estimates if they were made
-      if self.estimates:
-        if not os.path.exists(estimate_cache_dir):
-          os.mkdir(estimate_cache_dir)
-        with open(estimate_cache_file, 'wb') as f:
-          self.logger.info(f"Caching estimates at {estimate_cache_file}")
-          pickle.dump(self.estimates, f)
-      self._nuke_tor_browser()
+      # We don't know what state the browser was left in, so don't hand it out again.
+      self.pool.discard(member)
+      raise
 
-    return self.estimates
+    self.pool.release(member)
+    return extracted
 
 
 @dataclass
@@ -586,12 +843,18 @@ class SpreadsheetBuilder(object):
                logger: logging.Logger,
                cred_file=GOOGLE_CREDENTIALS_FILE):
     self.sh: Spreadsheet
-    self.worksheet: Worksheet  # active worksheet
+    self.worksheet_name: str  # active worksheet
 
     self.name = name
     self.params = params
     self.row = 1  # row to write to
     self.sheet_num = 0  # uid for each worksheet
+    # Rows of the active worksheet, starting at A1.
+    self._rows: list[list[str]] = []
+    # Finished worksheets that haven't been sent to the Sheets API yet, as ValueRanges
+    # (https://developers.google.com/sheets/api/reference/rest/v4/spreadsheets.values#ValueRange).
+    # They're all sent in a single request by self._write_worksheets().
+    self._value_ranges: list[dict] = []
 
     self.logger = logger
 
@@ -613,6 +876,9 @@ class SpreadsheetBuilder(object):
     # self.write_tuple("double furniture", f"=2 * {self._label_cache["furniture"]}")
     self._label_cache: dict[str, str] = {}
 
+    # Filled in formulas by label, for each worksheet layout (keyed by the number of rent rows).
+    self._formulas: dict[int, dict[str, str]] = {}
+
     # Google api's use this as the default credential if no other is provided.
     os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = cred_file
     # Find existing or create a new spreadsheet.
@@ -622,7 +888,6 @@ class SpreadsheetBuilder(object):
 
     client = service_account(filename=GOOGLE_CREDENTIALS_FILE)
     self.sh = client.open_by_key(key)
-    self.worksheet = self.sh.sheet1  # default to sheet1
 
   def _find_spreadsheet(self, name: str) -> SpreadsheetID:
     '''
@@ -669,140 +934,246 @@ class SpreadsheetBuilder(object):
     return id
 
   @gspread_retry
-  def _get_or_create_worksheet(self, name: str):
+  def _create_missing_worksheets(self, names: list[str]):
     '''
-    Gets a worksheet (if a worksheet by the given name exists) or creates a new one and sets the SpreadsheetBuilder to write to it.
+    Creates each of the named worksheets that doesn't exist yet, all in a single Sheets API request.
     '''
-    try:
-      self.logger.info(f"Trying to switch to worksheet {name}")
-      self.worksheet = self.sh.worksheet(name)
-    except WorksheetNotFound:
-      self.logger.info(f"Worksheet {name} not found, creating it instead")
-      self.worksheet = self.sh.add_worksheet(name, 1000, 26)
+    existing = {worksheet.title for worksheet in self.sh.worksheets()}
+    missing = [name for name in names if name not in existing]
+    if not missing:
+      return
+    self.logger.info(f"Worksheets {missing} not found, creating them")
+    self.sh.batch_update({
+        'requests': [{
+            'addSheet': {
+                'properties': {
+                    'title': name,
+                    'gridProperties': {
+                        'rowCount': 1000,
+                        'columnCount': 26
+                    }
+                }
+            }
+        } for name in missing]
+    })
+
+  def _switch_to_worksheet(self, name: str):
+    '''
+    Sets the SpreadsheetBuilder to write to the worksheet by the given name, which must already exist.
+    '''
+    self.logger.info(f"Switching to worksheet {name}")
+    self.worksheet_name = name
     self.row = 1
+    self._rows = []
+    # Labels only refer to cells on the worksheet they were written to.
+    self._label_cache = {}
 
-  @gspread_retry
   def _write_tuple(self, label: str, value: Union[str, Percentage, DollarAmount]):
-    self.logger.info(f"Writing tuple {label}, {value}")
-    A = f"A{self.row}"
-    B = f"B{self.row}"
-    self.worksheet.update(A, [[label, str(value)]], raw=False)
-    self._label_cache[label] = B
+    '''
+    Buffers a (label, value) row for the active worksheet, see self._finish_worksheet().
+    '''
+    self.logger.debug(f"Writing tuple {label}, {value}")
+    self._rows.append([label, str(value)])
+    self._label_cache[label] = f"B{self.row}"
     self.row += 1
 
   def skip_line(self):
-    self.logger.info("Skipping line")
+    self.logger.debug("Skipping line")
+    # An empty row leaves the cells in that row untouched.
+    self._rows.append([])
     self.row += 1
 
+  def _finish_worksheet(self):
+    '''
+    Queues the active worksheet's rows to be sent by self._write_worksheets().
+    '''
+    self._value_ranges.append({'range': f"'{self.worksheet_name}'!A1", 'values': self._rows})
+    self._rows = []
+
+  @gspread_retry
+  def _write_worksheets(self):
+    '''
+    Writes every finished worksheet in a single Sheets API request.
+    '''
+    if not self._value_ranges:
+      return
+    self.logger.info(f"Writing {len(self._value_ranges)} worksheets")
+    # USER_ENTERED makes Sheets parse formulas and numbers as if they were typed in.
+    self.sh.values_batch_update({'valueInputOption': 'USER_ENTERED', 'data': self._value_ranges})
+    self._value_ranges = []
+
   def get_label_cell(self, label: str) -> str:
     return self._label_cache[label]
 
   def build_spreadsheet(self):
-    for price in self.params.prices:
-      for down_payment_rate in self.params.down_payment_rates:
-        for closing_cost_rate in self.params.closing_cost_rates:
-          for immediate_repair_rate in self.params.immediate_repair_rates:
-            for furnishing_cost in self.params.furnishing_costs:
-              for yearly_mortgage_rate in self.params.yearly_mortgage_rates:
-                for monthly_utility_cost in self.params.monthly_utility_costs:
-                  for yearly_capex_rate in self.params.yearly_capex_rates:
-                    for yearly_maintenance_rate in self.params.yearly_maintenance_rates:
-                      for rent_estimate in self.params.rent_estimates:
-                        self._get_or_create_worksheet(str(self.sheet_num))
-
-                        # Upfront costs
-                        self._write_tuple("Upfront Costs", "")
-                        self._write_tuple("Price ($)", price)
-                        self._write_tuple("Down (%)", down_payment_rate)
-                        self._write_tuple("Closing cost rate (%)", closing_cost_rate)
-                        self._write_tuple("Immediate repair rate (%)", immediate_repair_rate)
-                        self._write_tuple(
-                            "Down Payment ($)",
-                            f'={self.get_label_cell("Price ($)")}*({self.get_label_cell("Down (%)")}/100)'
-                        )
-                        self._write_tuple(
-                            "Closing costs ($)",
-                            f'={self.get_label_cell("Price ($)")}*({self.get_label_cell("Closing cost rate (%)")}/100)'
-                        )
-                        self._write_tuple(
-                            "Immediate repairs ($)",
-                            f'={self.get_label_cell("Price ($)")}*({self.get_label_cell("Immediate repair rate (%)")}/100)'
-                        )
-                        self._write_tuple("Furnishing costs ($)", str(furnishing_cost))
-                        self._write_tuple(
-                            "TOTAL UPFRONT ($)",
-                            f'={self.get_label_cell("Down Payment ($)")}+{self.get_label_cell("Closing costs ($)")}+{self.get_label_cell("Immediate repairs ($)")}+{self.get_label_cell("Furnishing costs ($)")}'
-                        )
-
-                        # Rent estimates
-                        self.skip_line()
-                        self._write_tuple(f"Rents ({str(rent_estimate.type)})", "")
-                        gross_monthly_income_formula = "="
-                        for i in range(len(rent_estimate.units)):
-                          unit = rent_estimate.units[i].unit
-                          est = rent_estimate.units[i].monthly_rent
-                          label = f"Unit {i} ({unit.beds} beds, {unit.baths} baths)"
-                          self._write_tuple(label, est)
-                          gross_monthly_income_formula += self.get_label_cell(label)
-                          if i < len(rent_estimate.units) - 1:
-                            gross_monthly_income_formula += '+'
-                        self._write_tuple("GROSS MONTHLY INCOME (RENT)",
-                                          gross_monthly_income_formula)
-
-                        # Monthly expenses
-                        self.skip_line()
-                        down_payment = calc_down_payment(price, down_payment_rate)
-                        self._write_tuple("Mortgage rate (%)", yearly_mortgage_rate)
-                        self._write_tuple(
-                            "Total loan amount ($)",
-                            f'={self.get_label_cell("Price ($)")} - {self.get_label_cell("Down Payment ($)")}'
-                        )
-                        self._write_tuple("Capex rate (%, yearly)", yearly_capex_rate)
-                        self._write_tuple("Maintenance rate (%, yearly)", yearly_maintenance_rate)
-                        self._write_tuple("Management rate (%, monthly)",
-                                          self.params.monthly_management_rate)
-                        self._write_tuple(
-                            "Mortgage payment ($, monthly)",
-                            calc_monthly_mortgage_payment(price=price,
-                                                          yearly_rate=yearly_mortgage_rate,
-                                                          down_payment=down_payment))
-                        self._write_tuple(
-                            "Average capex ($, monthly)",
-                            f'={self.get_label_cell("Price ($)")}*({self.get_label_cell("Capex rate (%, yearly)")} / 100) / 12'
-                        )
-                        self._write_tuple(
-                            "Average maintenance ($, monthly)",
-                            f'={self.get_label_cell("Price ($)")}*({self.get_label_cell("Maintenance rate (%, yearly)")} / 100) / 12'
-                        )
-                        self._write_tuple(
-                            "Management fee ($, monthly)",
-                            f'={self.get_label_cell("GROSS MONTHLY INCOME (RENT)")} * ({self.get_label_cell("Management rate (%, monthly)")} / 100)'
-                        )
-                        self._write_tuple("Utilities ($, monthly)", monthly_utility_cost)
-                        self._write_tuple("Property taxes ($, monthly)",
-                                          self.params.monthly_property_taxes)
-                        self._write_tuple("HOA fees ($, monthly)", self.params.monthly_hoa_fees)
-                        self._write_tuple(
-                            "Mortgageless Monthly Expenses",
-                            f'={self.get_label_cell("Average capex ($, monthly)")} + {self.get_label_cell("Average maintenance ($, monthly)")} + {self.get_label_cell("Management fee ($, monthly)")} + {self.get_label_cell("Utilities ($, monthly)")} + {self.get_label_cell("Property taxes ($, monthly)")} + {self.get_label_cell("HOA fees ($, monthly)")}'
-                        )
-                        self._write_tuple(
-                            "Mortgageless Expenses / Rents (\"50% rule\"?)",
-                            f'={self.get_label_cell("Mortgageless Monthly Expenses")} / {self.get_label_cell("GROSS MONTHLY INCOME (RENT)")}'
-                        )
-                        self._write_tuple(
-                            "TOTAL MONTHLY EXPENSES",
-                            f'={self.get_label_cell("Mortgage payment ($, monthly)")} + {self.get_label_cell("Mortgageless Monthly Expenses")}'
-                        )
-
-                        self.skip_line()
-                        self._write_tuple("Bottom Line", "")
-                        self._write_tuple(
-                            "NET MONTHLY INCOME",
-                            f'={self.get_label_cell("GROSS MONTHLY INCOME (RENT)")} - {self.get_label_cell("TOTAL MONTHLY EXPENSES")}'
-                        )
-
-                        self.sheet_num += 1
+    # The mortgage payment only depends on the price, down payment rate and mortgage rate, so
+    # compute it up front for each combination of those instead of once per worksheet.
+    mortgage_payments = calc_monthly_mortgage_payments(self.params.prices,
+                                                       self.params.down_payment_rates,
+                                                       self.params.yearly_mortgage_rates)
+
+    # A rent estimate's rows are the same on every worksheet it appears on, so label them once.
+    rent_blocks = []
+    for rent_estimate in self.params.rent_estimates:
+      rent_rows = [(f"Unit {i} ({u.unit.beds} beds, {u.unit.baths} baths)", u.monthly_rent)
+                   for i, u in enumerate(rent_estimate.units)]
+      rent_blocks.append((f"Rents ({str(rent_estimate.type)})", rent_rows))
+
+    # Every combination of the swept parameters gets its own worksheet.
+    scenarios = list(
+        itertools.product(self.params.prices, self.params.down_payment_rates,
+                          self.params.closing_cost_rates, self.params.immediate_repair_rates,
+                          self.params.furnishing_costs, self.params.yearly_mortgage_rates,
+                          self.params.monthly_utility_costs, self.params.yearly_capex_rates,
+                          self.params.yearly_maintenance_rates, rent_blocks))
+    self._create_missing_worksheets(
+        [str(n) for n in range(self.sheet_num, self.sheet_num + len(scenarios))])
+
+    for scenario in scenarios:
+      price, down_payment_rate, _, _, _, yearly_mortgage_rate, _, _, _, _ = scenario
+      self._build_one_sheet(*scenario,
+                            mortgage_payments[(price, down_payment_rate, yearly_mortgage_rate)])
+      self.sheet_num += 1
+
+    self._write_worksheets()
+
+  def _build_one_sheet(self, price: DollarAmount, down_payment_rate: Percentage,
+                       closing_cost_rate: Percentage, immediate_repair_rate: Percentage,
+                       furnishing_cost: DollarAmount, yearly_mortgage_rate: Percentage,
+                       monthly_utility_cost: DollarAmount, yearly_capex_rate: Percentage,
+                       yearly_maintenance_rate: Percentage,
+                       rent_block: tuple[str, list[tuple[str, DollarAmount]]],
+                       monthly_mortgage_payment: DollarAmount):
+    '''
+    Builds a single scenario (one combination of the swept ScenarioParams) as worksheet self.sheet_num.
+    rent_block is the heading of a rent estimate and its (label, monthly rent) row for each unit.
+    '''
+    self._switch_to_worksheet(str(self.sheet_num))
+    # Every row goes through these, so bind them once rather than looking them up on self each time.
+    write, skip_line, params = self._write_tuple, self.skip_line, self.params
+    rents_label, rent_rows = rent_block
+
+    # Worksheets only differ in layout by the number of rent rows, so each formula is only filled in
+    # for the first worksheet of a layout and reused for the rest.
+    formulas = self._formulas.setdefault(len(rent_rows), {})
+
+    def write_formula(label: str, template: str):
+      '''
+      Writes a formula row. Each {label} field in template is replaced by the cell holding that label,
+      so labels used in templates mustn't contain any of the characters str.format treats specially
+      (".", "[", ":", "!").
+      '''
+      if label not in formulas:
+        formulas[label] = template.format_map(self._label_cache)
+      write(label, formulas[label])
+
+    # Upfront costs
+    write("Upfront Costs", "")
+    write("Price ($)", price)
+    write("Down (%)", down_payment_rate)
+    write("Closing cost rate (%)", closing_cost_rate)
+    write("Immediate repair rate (%)", immediate_repair_rate)
+    write_formula("Down Payment ($)", "={Price ($)}*({Down (%)}/100)")
+    write_formula("Closing costs ($)", "={Price ($)}*({Closing cost rate (%)}/100)")
+    write_formula("Immediate repairs ($)", "={Price ($)}*({Immediate repair rate (%)}/100)")
+    write("Furnishing costs ($)", str(furnishing_cost))
+    write_formula(
+        "TOTAL UPFRONT ($)",
+        "={Down Payment ($)}+{Closing costs ($)}+{Immediate repairs ($)}+{Furnishing costs ($)}")
+
+    # Rent estimates
+    skip_line()
+    write(rents_label, "")
+    for label, est in rent_rows:
+      write(label, est)
+    # The unit labels contain the number of beds and baths, e.g. "Unit 0 (2.0 beds, 1.5 baths)", which
+    # can't go in a template, so this formula is put together from the cells directly.
+    if "GROSS MONTHLY INCOME (RENT)" not in formulas:
+      formulas["GROSS MONTHLY INCOME (RENT)"] = "=" + "+".join(self._label_cache[label]
+                                                               for label, _ in rent_rows)
+    write("GROSS MONTHLY INCOME (RENT)", formulas["GROSS MONTHLY INCOME (RENT)"])
+
+    # Monthly expenses
+    skip_line()
+    write("Mortgage rate (%)", yearly_mortgage_rate)
+    write_formula("Total loan amount ($)", "={Price ($)} - {Down Payment ($)}")
+    write("Capex rate (%, yearly)", yearly_capex_rate)
+    write("Maintenance rate (%, yearly)", yearly_maintenance_rate)
+    write("Management rate (%, monthly)", params.monthly_management_rate)
+    write("Mortgage payment ($, monthly)", monthly_mortgage_payment)
+    write_formula("Average capex ($, monthly)",
+                  "={Price ($)}*({Capex rate (%, yearly)} / 100) / 12")
+    write_formula("Average maintenance ($, monthly)",
+                  "={Price ($)}*({Maintenance rate (%, yearly)} / 100) / 12")
+    write_formula("Management fee ($, monthly)",
+                  "={GROSS MONTHLY INCOME (RENT)} * ({Management rate (%, monthly)} / 100)")
+    write("Utilities ($, monthly)", monthly_utility_cost)
+    write("Property taxes ($, monthly)", params.monthly_property_taxes)
+    write("HOA fees ($, monthly)", params.monthly_hoa_fees)
+    write_formula(
+        "Mortgageless Monthly Expenses",
+        "={Average capex ($, monthly)} + {Average maintenance ($, monthly)} + {Management fee ($, monthly)} + {Utilities ($, monthly)} + {Property taxes ($, monthly)} + {HOA fees ($, monthly)}"
+    )
+    write_formula("Mortgageless Expenses / Rents (\"50% rule\"?)",
+                  "={Mortgageless Monthly Expenses} / {GROSS MONTHLY INCOME (RENT)}")
+    write_formula("TOTAL MONTHLY EXPENSES",
+                  "={Mortgage payment ($, monthly)} + {Mortgageless Monthly Expenses}")
+
+    skip_line()
+    write("Bottom Line", "")
+    write_formula("NET MONTHLY INCOME", "={GROSS MONTHLY INCOME (RENT)} - {TOTAL MONTHLY EXPENSES}")
+
+    self._finish_worksheet()
+
+
+SCENARIO_CSV_HEADER = [
+    "Price ($)", "Down (%)", "Closing cost rate (%)", "Immediate repair rate (%)",
+    "Furnishing costs ($)", "Mortgage rate (%)", "Utilities ($, monthly)", "Capex rate (%, yearly)",
+    "Maintenance rate (%, yearly)", "Rent estimate", "TOTAL UPFRONT ($)",
+    "GROSS MONTHLY INCOME (RENT)", "Mortgage payment ($, monthly)", "Mortgageless Monthly Expenses",
+    "TOTAL MONTHLY EXPENSES", "NET MONTHLY INCOME"
+]
+
+
+def build_scenarios_csv(filename: str, params: ScenarioParams, logger: logging.Logger):
+  '''
+  Evaluates every scenario that SpreadsheetBuilder.build_spreadsheet would create a worksheet for and
+  writes one gzipped CSV row per scenario (see SCENARIO_CSV_HEADER), with the totals computed in Python
+  rather than as spreadsheet formulas. Useful when only the numbers are needed, since it doesn't touch
+  the Google APIs at all.
+  '''
+  mortgage_payments = calc_monthly_mortgage_payments(params.prices, params.down_payment_rates,
+                                                     params.yearly_mortgage_rates)
+  fixed_monthly_costs = params.monthly_property_taxes + params.monthly_hoa_fees
+  # Gross income only depends on the rent estimate, so sum each estimate's units once up front.
+  rent_incomes = [(rent_estimate, sum(u.monthly_rent for u in rent_estimate.units))
+                  for rent_estimate in params.rent_estimates]
+
+  logger.info(f"Writing scenarios to {filename}")
+  with gzip.open(filename, 'wt', compresslevel=1, newline='') as f:
+    writer = csv.writer(f)
+    writer.writerow(SCENARIO_CSV_HEADER)
+    for (price, down_payment_rate, closing_cost_rate, immediate_repair_rate, furnishing_cost,
+         yearly_mortgage_rate, monthly_utility_cost, yearly_capex_rate, yearly_maintenance_rate,
+         (rent_estimate, gross_monthly_income)) in itertools.product(
+             params.prices, params.down_payment_rates, params.closing_cost_rates,
+             params.immediate_repair_rates, params.furnishing_costs, params.yearly_mortgage_rates,
+             params.monthly_utility_costs, params.yearly_capex_rates,
+             params.yearly_maintenance_rates, rent_incomes):
+      total_upfront = price * (down_payment_rate + closing_cost_rate +
+                               immediate_repair_rate) / 100 + furnishing_cost
+      mortgage_payment = mortgage_payments[(price, down_payment_rate, yearly_mortgage_rate)]
+      mortgageless_expenses = (price * (yearly_capex_rate + yearly_maintenance_rate) / 100 / 12 +
+                               gross_monthly_income * params.monthly_management_rate / 100 +
+                               monthly_utility_cost + fixed_monthly_costs)
+      total_monthly_expenses = mortgage_payment + mortgageless_expenses
+      writer.writerow([
+          price, down_payment_rate, closing_cost_rate, immediate_repair_rate, furnishing_cost,
+          yearly_mortgage_rate, monthly_utility_cost, yearly_capex_rate, yearly_maintenance_rate,
+          rent_estimate.type.value, total_upfront, gross_monthly_income, mortgage_payment,
+          mortgageless_expenses, total_monthly_expenses,
+          gross_monthly_income - total_monthly_expenses
+      ])
 
 
 @dataclass
@@ -823,44 +1194,64 @@ if __name__ == '__main__':
           "https://www.compass.com/listing/265-vistawood-drive-northeast-marietta-ga-30066/953808184193214265/",
           [Unit(2, 1), Unit(1, 1)])
   ]
-  for input in inputs:
-    try:
-      page = requests.get(input.url)
-      listing = from_raw(page.text, input.units)
-      logger = get_logger(listing.pretty_address)
-      logger.info(f"Units at {listing.pretty_address}: {listing.units}")
-
-      rent_estimator = RentEstimator(logger)
-      estimates = rent_estimator.estimate(listing)
-      s = SpreadsheetBuilder(
-          listing.pretty_address,
-          ScenarioParams(
-              # Upfront expenses
-              prices=[listing.price],
-              down_payment_rates=[5],
-              closing_cost_rates=[3],
-              immediate_repair_rates=[3],
-              furnishing_costs=[10000],
-
-              # Recurring income
-              rent_estimates=[e for e in estimates if e.type == EstimateType.AVERAGE],
-              # rent_estimates=estimates,
-
-              # Recurring expenses
-              yearly_mortgage_rates=[3.23],
-              monthly_utility_costs=[300],
-              yearly_capex_rates=[1.25],
-              yearly_maintenance_rates=[0.5],
-              monthly_management_rate=10,
-              monthly_property_taxes=0,  # TODO
-              monthly_hoa_fees=0,  # TODO
-          ),
-          logger)
-      s.build_spreadsheet()
-    except Exception as e:
-      logger.error(e)
-      continue
+  # Downloading the listing pages is network bound and independent of everything else, so fetch them
+  # all concurrently up front. The Session reuses connections to the listing site across fetches;
+  # its pool holds one connection per fetching thread so none of them has to reconnect.
+  fetch_workers = max(1, min(32, len(inputs)))
+  session = requests.Session()
+  adapter = HTTPAdapter(pool_connections=fetch_workers, pool_maxsize=fetch_workers)
+  session.mount('https://', adapter)
+  session.mount('http://', adapter)
+  with ThreadPoolExecutor(max_workers=fetch_workers) as executor:
+    pages = [
+        executor.submit(session.get, input.url, timeout=REQUEST_TIMEOUT_SECS) for input in inputs
+    ]
+
+  # Rentometer browsers are kept alive across listings, and only relaunched when throttled.
+  rent_browsers = TorBrowserPool(logger)
+  try:
+    for input, page_future in zip(inputs, pages):
+      try:
+        page = page_future.result()
+        listing = from_raw(page.text, input.units)
+        logger = get_logger(listing.pretty_address)
+        logger.info(f"Units at {listing.pretty_address}: {listing.units}")
+
+        rent_estimator = RentEstimator(logger, rent_browsers)
+        estimates = rent_estimator.estimate(listing)
+        params = ScenarioParams(
+            # Upfront expenses
+            prices=[listing.price],
+            down_payment_rates=[5],
+            closing_cost_rates=[3],
+            immediate_repair_rates=[3],
+            furnishing_costs=[10000],
+
+            # Recurring income
+            rent_estimates=[e for e in estimates if e.type == EstimateType.AVERAGE],
+            # rent_estimates=estimates,
+
+            # Recurring expenses
+            yearly_mortgage_rates=[3.23],
+            monthly_utility_costs=[300],
+            yearly_capex_rates=[1.25],
+            yearly_maintenance_rates=[0.5],
+            monthly_management_rate=10,
+            monthly_property_taxes=0,  # TODO
+            monthly_hoa_fees=0,  # TODO
+        )
+        # Write the numbers locally first, so they're still there if building the sheet fails.
+        scenarios_dir = os.path.join(CACHEDIR, listing.pretty_address)
+        os.makedirs(scenarios_dir, exist_ok=True)
+        build_scenarios_csv(os.path.join(scenarios_dir, SCENARIOS_FILE), params, logger)
+        s = SpreadsheetBuilder(listing.pretty_address, params, logger)
+        s.build_spreadsheet()
+      except Exception as e:
+        logger.error(e)
+        continue
+  finally:
+    rent_browsers.close()
 
   executionTime = (time.time() - startTime)
-  pprint('Execution time in seconds: ' + str(executionTime))
+  print('Execution time in seconds: ' + str(executionTime))
   exit(0)
@@ -1,78 +1,105 @@
-import time, logging, os, sys
-from typing import Callable, cast
+import time, logging, logging.handlers, os, sys, itertools, functools
+from typing import Callable, Iterable
 from types_ import Percentage, DollarAmount, Year
 from gspread.exceptions import APIError
-from constants import LOGSDIR, LOGFILE, LOGFMT
+from constants import LOGSDIR, LOGFILE, LOGFMT, LOG_BUFFER_CAPACITY
 
 
-def calc_monthly_mortgage_payment(price: DollarAmount,
-                                  yearly_rate: Percentage,
-                                  down_payment: DollarAmount,
-                                  mortgage_length: Year = 30) -> DollarAmount:
-
-  # calculates the monthly mortgage payment based on the price of the home and rate/length of the mortgage.
+def _amortization_factor(yearly_rate: Percentage, mortgage_length: Year) -> float:
+  # The part of the fixed rate loan payment formula (below) that doesn't depend on the principal,
+  # i.e. M / p.
   # M = p [ r(1 + r)^n ] / [ (1 + r)^n – 1]
   # M = monthly mortgage payment
   # p = the principal amount
   # r = your monthly interest rate. Your lender likely lists interest rates as an annual figure, so you’ll need to divide by 12, for each month of the year. So, if your rate is 5%, then the monthly rate will look like this: 0.05/12 = 0.004167.
   # n = the number of payments over the life-span of the loan. If you take out a 30-year fixed rate mortgage, this means:- n = 30 years x 12 months per year, or 360 payments.
-  def _calc_monthly_payment(p: DollarAmount, yearly_rate: Percentage,
-                            mortgage_length: Year) -> DollarAmount:
-    n = mortgage_length * 12
-    r = yearly_rate / 100.0 / 12.0
-
-    return p * (r * (1 + r)**n) / ((1 + r)**n - 1)
+  n = mortgage_length * 12
+  r = yearly_rate / 100.0 / 12.0
+  growth = (1 + r)**n
 
-  p = price - down_payment
-
-  return _calc_monthly_payment(p, yearly_rate, mortgage_length)
+  return (r * growth) / (growth - 1)
 
 
 def calc_down_payment(price: DollarAmount, percent_down: Percentage) -> DollarAmount:
   return price * (percent_down / 100)
 
 
+def calc_monthly_mortgage_payments(
+    prices: Iterable[DollarAmount],
+    percents_down: Iterable[Percentage],
+    yearly_rates: Iterable[Percentage],
+    mortgage_length: Year = 30) -> dict[tuple[DollarAmount, Percentage, Percentage], DollarAmount]:
+  '''
+  Calculates the monthly mortgage payment for every combination of price, down payment percentage and
+  yearly rate, returned as a table keyed by (price, percent_down, yearly_rate).
+  '''
+  # The same few rates get used for every price and down payment, so work out each rate's
+  # amortization factor (and its 360th power) once, rather than once per payment.
+  factors = {
+      yearly_rate: _amortization_factor(yearly_rate, mortgage_length)
+      for yearly_rate in yearly_rates
+  }
+  payments: dict[tuple[DollarAmount, Percentage, Percentage], DollarAmount] = {}
+  for price, percent_down in itertools.product(prices, percents_down):
+    # The loan amount doesn't depend on the rate, so work it out once per (price, percent_down).
+    principal = price - calc_down_payment(price, percent_down)
+    for yearly_rate, factor in factors.items():
+      payments[(price, percent_down, yearly_rate)] = principal * factor
+  return payments
+
+
 def gspread_retry(func: Callable) -> Callable:
   '''
-  Throttling approach of hitting the Google Sheets api until we get a 429, then waiting a minute before continuing.
+  Throttling approach of hitting the Google Sheets api until we get a 429, then backing off exponentially
+  (or for as long as the response's Retry-After header asks) before trying again. Gives up and re-raises
+  the 429 after MAX_ATTEMPTS tries.
   '''
-  INTERVAL_SECS = 0
+  MAX_ATTEMPTS = 8
+  MAX_INTERVAL_SECS = 64
 
+  @functools.wraps(func)
   def wrapper(*args, **kwargs):
-    try:
-      func(*args, **kwargs)
-    except APIError as e:
-      if "'code': 429" in str(e):
-        logging.warning(f"Google Sheets API limit reached, pausing for {INTERVAL_SECS}")
-        time.sleep(INTERVAL_SECS)
-        wrapper(*args, **kwargs)
-      else:
-        raise e
+    interval_secs = 1
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+      try:
+        return func(*args, **kwargs)
+      except APIError as e:
+        # Check the status code directly rather than formatting the whole error (and its response body).
+        if getattr(e.response, 'status_code', None) != 429 or attempt == MAX_ATTEMPTS:
+          raise
+        retry_after = e.response.headers.get('Retry-After', '')
+        pause_secs = int(retry_after) if retry_after.isdigit() else interval_secs
+        logging.warning(
+            f"Google Sheets API limit reached, pausing for {pause_secs}s (attempt {attempt}/{MAX_ATTEMPTS})"
+        )
+        time.sleep(pause_secs)
+        interval_secs = min(interval_secs * 2, MAX_INTERVAL_SECS)
 
   return wrapper
 
 
+# Formatters are stateless, so every handler shares this one.
+LOG_FORMATTER = logging.Formatter(LOGFMT)
+
+
 def get_logger(pretty_address: str = "root") -> logging.Logger:
   '''
   Gets a logger by the given name (pretty_address) or creates it if it doesn't exist, with this application's preferred logger settings.
   If pretty_address is "root", returns the root logger logging to stdout and LOGSDIR/root.
   '''
-  _existing_log = logging.Logger.manager.loggerDict.get(pretty_address)
-  if _existing_log is not None and type(_existing_log) is not logging.PlaceHolder:
-    existing_log = cast(logging.Logger, _existing_log)
-    return existing_log
-
-  # logging.getLogger("") returns the root logger
+  # logging.getLogger("root") returns the root logger
   logger = logging.getLogger(pretty_address)
-  logdir = os.path.join(LOGSDIR, pretty_address)
+  # A logger we've already set up has its handlers, so don't open another file for it. (The root
+  # logger never shows up in the logging manager's loggerDict, so checking that isn't enough.)
+  if logger.handlers:
+    return logger
 
-  if not os.path.exists(logdir):
-    os.makedirs(logdir)
+  logdir = os.path.join(LOGSDIR, pretty_address)
+  os.makedirs(logdir, exist_ok=True)
   logfile = os.path.join(logdir, LOGFILE)
 
-  formatter = logging.Formatter(LOGFMT)
   fileHandler = logging.FileHandler(logfile)
-  fileHandler.setFormatter(formatter)
+  fileHandler.setFormatter(LOG_FORMATTER)
 
   logger.addHandler(fileHandler)
   logger.setLevel(logging.DEBUG)  # TODO: make configurable
@@ -80,7 +107,12 @@ def get_logger(pretty_address: str = "root") -> logging.Logger:
   # The root logger should still print everything to the console.
   if pretty_address == "root":
     stderrHandler = logging.StreamHandler(sys.stderr)
-    stderrHandler.setFormatter(formatter)
-    logger.addHandler(stderrHandler)
-
-  return logger
\ No newline at end of file
+    stderrHandler.setFormatter(LOG_FORMATTER)
+    # Console writes are batched, but warnings (throttling, retries) and errors are written out
+    # immediately (along with everything buffered before them) so the console keeps up with a long run.
+    memoryHandler = logging.handlers.MemoryHandler(LOG_BUFFER_CAPACITY,
+                                                   flushLevel=logging.WARNING,
+                                                   target=stderrHandler)
+    logger.addHandler(memoryHandler)
+
+  return logger